@@ -1,14 +1,644 @@
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+import lxml.etree
+import lxml.html
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers, Retry
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 import streamlit as st
 from io import BytesIO
+import codecs
+import os
+import sys
+import queue
+import threading
 import time
+from functools import lru_cache, partial
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import tempfile
+import re
+from pathlib import Path
+import orjson
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, unquote
 
 # Constants
-TIMEOUT = 20  # seconds for HTTP requests
+TIMEOUT = 20  # seconds for HTTP reads (and Chrome page loads)
+CONNECT_TIMEOUT = 5  # seconds to establish a connection; unreachable hosts fail fast
 COMPANY_NAME = "Swagelok"
+MAX_WORKERS = 8  # Chrome drivers at most; default concurrency for page fetches
+MAX_CONCURRENCY = 64  # upper bound of the concurrency slider
+MAX_REQUESTS_PER_SECOND = 20  # default cap on network requests (cache hits are free)
 CHECKPOINT_INTERVAL = 100  # save checkpoint every 100 URLs
+UI_REFRESH_INTERVAL = 0.5  # seconds between progress redraws (~2 Hz)
+CSV_CHECKPOINT_ROWS = 5000  # larger runs checkpoint to CSV (much cheaper to write than XLSX)
+MAX_PAGE_BYTES = 2_000_000  # pages declaring a larger body are not product pages; skipped unread
+READ_LIMIT_BYTES = 512 * 1024  # Part # and the UNSPSC rows sit well within the first 512 KiB
+UNSPSC_WINDOW_BEFORE = 2048  # chars kept before the first "UNSPSC" label (opens the spec table)
+UNSPSC_WINDOW_AFTER = 8192  # chars kept after the last one (its value cells)
+HTTP_CACHE_NAME = "swagelok_cache"  # on-disk (SQLite) HTTP cache shared across runs
+HTTP_CACHE_EXPIRE = 7 * 24 * 3600  # seconds a cached page is served without refetching
+RESULT_COLUMNS = ["Part", "UNSPSC Feature (Latest)", "UNSPSC Code", "Status", "Error"]
+STATE_FILE = Path("state.jsonl")  # fetched results persisted across app restarts (appended; compacted on load)
+STATE_EXPIRE = HTTP_CACHE_EXPIRE  # seconds a persisted result is reused without refetching
+LOW_CARDINALITY_COLUMNS = ["Company", "UNSPSC Feature (Latest)", "UNSPSC Code"]  # category dtype in the output
+BLOCKED_RESOURCES = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.css", "*.woff", "*.woff2", "*.ttf"]  # never loaded by the Chrome fallback
+RENDER_WAIT = 5  # seconds the Chrome fallback waits for UNSPSC rows to appear
+
+
+_TRACKING_PARAMS = ("utm_", "gclid", "fbclid")
+
+
+# Canonical key for a URL so trivially different spellings (and links that
+# only differ by tracking parameters) are fetched once; None for a link that
+# cannot be parsed (e.g. a malformed IPv6 host), which is then an invalid URL
+def _canonicalize(url):
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    path = unquote(parts.path).rstrip("/") or "/"
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+              if not k.lower().startswith(_TRACKING_PARAMS)]
+    query = urlencode(sorted(params))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+_EXCLUDE_RE = re.compile(r'charset|utf|html|text|http|www|content|application|javascript|css', re.IGNORECASE)
+_HAS_LETTER_RE = re.compile(r'[A-Za-z]')
+_HAS_DIGIT_RE = re.compile(r'\d')
+
+
+# Whether text next to a split "Part #" label in the tree fallback looks like
+# a part number: 3-100 characters with at least one letter and one digit, and
+# not HTML/meta noise picked up from a neighbouring element. Each check is a
+# single C-level scan, and results are memoized. An inline "Part #: X" match
+# is taken as-is, as it always was
+@lru_cache(maxsize=8192)
+def _is_valid_part(part):
+    if not 3 <= len(part) <= 100:
+        return False
+    return bool(_HAS_LETTER_RE.search(part) and _HAS_DIGIT_RE.search(part)
+                and not _EXCLUDE_RE.search(part))
+
+
+# Text and non-cell tags (</span>, <b>, ...) between a UNSPSC label and its
+# code; never a digit, a row boundary or another cell boundary
+_UNSPSC_GAP = r'(?:[^\d<]|<(?!/?t[dr]\b)[^>]*>){0,200}?'
+# "Part #: X" / "Part Number: X" and inline "UNSPSC (ver) ... code" matches in
+# one pass over the page. The code is in the label's own cell or the one
+# right after it, so a label with no code never borrows a later row's number
+_PAGE_FIELDS_RE = re.compile(
+    r'Part\s*(?:#|Number)\s*:\s*(?P<part>[A-Z0-9.\-_/]+)'
+    r'|UNSPSC\s*\((?P<ver>[\d.]+)\)' + _UNSPSC_GAP
+    + r'(?:</td\s*>\s*<td\b[^>]*>' + _UNSPSC_GAP + r')?(?P<code>\d{6,8})(?!\d)',
+    re.IGNORECASE)
+_PAGE_FIELD_LABELS = ("part", "unspsc")  # lower-cased text every match starts with
+# Any Part #/Part Number or UNSPSC label, inline or split across tags
+_FIELD_LABEL_RE = re.compile(r'part\s*(?:#|number)|unspsc', re.IGNORECASE)
+_PART_DOM_RE = re.compile(r'Part\s*(?:#|Number)\s*:?\s*([A-Z0-9.\-_/]+)', re.IGNORECASE)
+_PART_LABELS_XPATH = ("//*[self::dt or self::th or self::strong or self::span or self::label]"
+                      "[starts-with(normalize-space(.), 'Part #') or starts-with(normalize-space(.), 'Part Number')]")
+_UNSPSC_ATTR_RE = re.compile(r'\(([\d.]+)\)')
+_UNSPSC_CODE_RE = re.compile(r'^\d{6,8}$')
+# Spec rows with a second cell whose first cell starts with "UNSPSC" (any case)
+_UNSPSC_ROWS_XPATH = "//tr[td[2]][starts-with(translate(normalize-space(td[1]), 'unspsc', 'UNSPSC'), 'UNSPSC')]"
+
+
+# Elements the tree fallbacks never read; dropped before parsing so lxml does
+# not build nodes for inline scripts, styles, icons and base64 blobs
+_NOISE_RE = re.compile(r'<(script|style|svg|noscript)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+
+
+# lxml tree for a decoded page, without script/style/svg content. A page with
+# nothing left to parse (only scripts or comments, as on JS redirect stubs)
+# gives an empty tree, so the tree fallbacks find nothing
+def _parse_html(html):
+    html = _NOISE_RE.sub('', html)
+    try:
+        try:
+            return lxml.html.fromstring(html)
+        except ValueError:  # str input that carries an XML encoding declaration
+            return lxml.html.fromstring(html.encode("utf-8"))
+    except lxml.etree.ParserError:
+        return lxml.html.Element("html")
+
+
+# _PAGE_FIELDS_RE matches in the order finditer would yield them. A match can
+# only start on a "part" or "unspsc" label (any case), so those offsets are
+# located with str.find and the regex is tried there alone, instead of at
+# every offset of a page that is mostly markup
+def _page_field_matches(html):
+    lowered = html.lower()
+    if len(lowered) != len(html):  # lower() changed some offsets
+        yield from _PAGE_FIELDS_RE.finditer(html)
+        return
+    offsets = []
+    for label in _PAGE_FIELD_LABELS:
+        i = lowered.find(label)
+        while i != -1:
+            offsets.append(i)
+            i = lowered.find(label, i + 1)
+    offsets.sort()
+    end = 0
+    for i in offsets:
+        if i < end:
+            continue
+        m = _PAGE_FIELDS_RE.match(html, i)
+        if m:
+            end = m.end()
+            yield m
+
+
+# First "Part #: X" value, the latest inline UNSPSC (feature, code) and
+# the number of UNSPSC labels matched, from a single regex scan of the HTML
+def _scan_html(html):
+    part = None
+    best_ver, best_feat, best_code = (-1,), None, None
+    unspsc_hits = 0
+    for m in _page_field_matches(html):
+        if m.group('code'):
+            unspsc_hits += 1
+            feature = sys.intern(f"UNSPSC ({m.group('ver')})")
+            ver = _parse_version(feature)
+            if ver > best_ver:
+                best_ver, best_feat, best_code = ver, feature, m.group('code')
+        elif part is None:
+            part = m.group('part').strip()
+    return part, best_feat, best_code, unspsc_hits
+
+
+# Part number from labels split across tags (<dt>Part #</dt><dd>X</dd>), or None
+def _extract_part_from_tree(tree):
+    for label in tree.xpath(_PART_LABELS_XPATH):
+        sibling = label.getnext()
+        text = " ".join((label.text_content(), label.tail or "",
+                         sibling.text_content() if sibling is not None else ""))
+        m = _PART_DOM_RE.search(text)
+        if m and _is_valid_part(m.group(1)):
+            return m.group(1).strip()
+    return None
+
+
+# Version tuple from the "(17.1001)" in a UNSPSC label; labels without one sort
+# last. Only a handful of distinct labels exist, so results are memoized
+@lru_cache(maxsize=4096)
+def _parse_version(feature):
+    m = _UNSPSC_ATTR_RE.search(feature)
+    if not m:
+        return (0,)
+    return tuple(int(p) for p in m.group(1).split('.') if p)
+
+
+# Latest (feature, code) from spec-table rows. One XPath query (run in C)
+# returns only UNSPSC rows, so unrelated nav/footer rows are never visited
+def _latest_unspsc_from_tree(tree):
+    best_ver, best_feat, best_code = (-1,), None, None
+    for tr in tree.xpath(_UNSPSC_ROWS_XPATH):
+        cells = tr.findall('td')
+        val = cells[1].text_content().strip()
+        if not _UNSPSC_CODE_RE.match(val):
+            continue
+        feature = sys.intern(cells[0].text_content().strip())
+        ver = _parse_version(feature)
+        if ver > best_ver:
+            best_ver, best_feat, best_code = ver, feature, val
+    return best_feat, best_code
+
+
+# Part, UNSPSC feature and UNSPSC code for a page (None where not found).
+# The raw-HTML regex scan handles most pages; the page is only parsed into an
+# lxml tree, once, when the part comes up empty or when some "UNSPSC" label
+# was not matched by the scan (split across tags, no version, ...). Then the
+# spec table decides the UNSPSC fields, as a label the scan missed may be the
+# latest one. When the part is known, just the region around the "UNSPSC"
+# labels is parsed, and nothing at all if the page has no such label
+def _extract_fields(html):
+    # Error pages and non-product URLs carry neither label; one search rules
+    # them out before any other regex or parsing work
+    if not _FIELD_LABEL_RE.search(html):
+        return None, None, None
+    lowered = html.lower()
+    part, feature, code, unspsc_hits = _scan_html(html)
+    tree = None
+    if not part and html.strip():
+        tree = _parse_html(html)
+        part = _extract_part_from_tree(tree)
+    labels = lowered.count("unspsc")
+    if labels > unspsc_hits:
+        if tree is None and len(lowered) == len(html):
+            first, last = lowered.find("unspsc"), lowered.rfind("unspsc")
+            tree = _parse_html(html[max(0, first - UNSPSC_WINDOW_BEFORE):last + UNSPSC_WINDOW_AFTER])
+        elif tree is None:
+            tree = _parse_html(html)
+        table_feature, table_code = _latest_unspsc_from_tree(tree)
+        if table_code:
+            feature, code = table_feature, table_code
+    return part, feature, code
+
+
+# Body of a streamed HTML response, capped at READ_LIMIT_BYTES. Returns
+# (None, reason) for responses that cannot be a product page, before any
+# of the body is downloaded
+def _read_html(resp):
+    content_type = resp.headers.get("Content-Type", "")
+    if content_type and "html" not in content_type.lower():
+        return None, f"Not an HTML page ({content_type.split(';')[0]})"
+    length = resp.headers.get("Content-Length", "")
+    if length.isdigit() and int(length) > MAX_PAGE_BYTES:
+        return None, f"Page too large ({int(length) // 1024} KB)"
+    body = resp.raw.read(READ_LIMIT_BYTES, decode_content=True)
+    # requests assumes ISO-8859-1 for text/* without a charset; pages are UTF-8.
+    # A declared charset Python does not know (e.g. utf8mb4) also falls back
+    encoding = resp.encoding if "charset" in content_type.lower() else None
+    try:
+        codecs.lookup(encoding or "utf-8")
+    except LookupError:
+        encoding = None
+    return body.decode(encoding or "utf-8", errors="replace"), ""
+
+
+# Only HTML responses that declare a body of at most READ_LIMIT_BYTES are kept
+# in the HTTP cache. requests-cache reads and stores the whole body before
+# _read_html sees it, so caching a larger or chunked (undeclared) response
+# would download all of it and defeat the read cap; those stay streamed
+def _is_cacheable(resp):
+    length = resp.headers.get("Content-Length", "")
+    return ("html" in resp.headers.get("Content-Type", "html").lower()
+            and length.isdigit() and int(length) <= READ_LIMIT_BYTES)
+
+
+# HTTP adapter that spaces requests at most `rate` per second across all
+# workers (0 = no limit). It sits below the cache, so pages served from the
+# cache never wait
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, rate=0, **kwargs):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._next_slot - now
+                self._next_slot = max(now, self._next_slot) + self._interval
+            if wait > 0:
+                time.sleep(wait)
+        return super().send(request, **kwargs)
+
+
+# Shared HTTP session: pages are cached on disk (SQLite) so re-runs are served
+# locally, with the stale copy used if the site errors; one keep-alive
+# connection per worker (so TLS handshakes are reused instead of dropped when
+# the default pool of 10 overflows; a full pool makes callers wait rather than
+# open throwaway connections), a couple of retries on transient gateway
+# errors, and compressed HTML
+def _make_session(workers=MAX_WORKERS, use_cache=True, rate=0):
+    session = requests_cache.CachedSession(
+        HTTP_CACHE_NAME, backend="sqlite", expire_after=HTTP_CACHE_EXPIRE,
+        allowable_codes=(200,), stale_if_error=True, filter_fn=_is_cacheable)
+    session.settings.disabled = not use_cache
+    # Jittered backoff so workers that failed together do not retry in lockstep
+    retries = Retry(total=2, backoff_factor=0.3, backoff_jitter=0.3,
+                    status_forcelist=[500, 502, 503, 504], raise_on_status=False)
+    adapter = RateLimitedAdapter(rate, pool_connections=workers, pool_maxsize=workers * 2,
+                                 max_retries=retries, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # urllib3 only lists "br" when brotli is installed
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0",
+        "Accept": "text/html,application/xhtml+xml",
+        "Accept-Encoding": make_headers(accept_encoding=True)["accept-encoding"],
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+# Default result for a row before anything is found
+def _new_result():
+    return {
+        "Part": "Not Found",
+        "UNSPSC Feature (Latest)": "Not Found",
+        "UNSPSC Code": "Not Found",
+        "Status": "Success",
+        "Error": ""
+    }
+
+
+# Headless Chrome with the page-load timeout applied. Only the DOM is read,
+# so get() returns at DOMContentLoaded instead of waiting for the full load
+# event. Images are turned off by content setting; stylesheets and fonts
+# have no such setting and are blocked by URL pattern (BLOCKED_RESOURCES)
+def _new_driver():
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.page_load_strategy = "eager"
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    driver = webdriver.Chrome(options=options)
+    driver.set_page_load_timeout(TIMEOUT)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_RESOURCES})
+    return driver
+
+
+# Chrome drivers shared by the fetch workers. At most `size` are alive; each
+# is started on first use and reused for later pages (cookies cleared)
+# instead of launching and quitting a browser per page
+class DriverPool:
+    def __init__(self, size):
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return _new_driver()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, driver):
+        try:
+            driver.delete_all_cookies()
+        except Exception:
+            self.discard(driver)
+            return
+        self._idle.put(driver)
+        self._slots.release()
+
+    # Quit a driver that failed mid-page; its slot is refilled on demand
+    def discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        self._slots.release()
+
+    # Quit the idle drivers (the pool itself stays usable)
+    def close_all(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+# One pool per Streamlit server process
+@st.cache_resource
+def _driver_pool():
+    return DriverPool(MAX_WORKERS)
+
+
+# Page source of `url` after its scripts have run, on a pooled driver. With
+# eager loading get() returns before scripts fill in the spec table, so wait
+# (bounded) for a UNSPSC row; pages without one are returned as they are
+def _render_page(drivers, url):
+    driver = drivers.acquire()
+    try:
+        driver.get(url)
+        try:
+            WebDriverWait(driver, RENDER_WAIT).until(
+                EC.presence_of_element_located((By.XPATH, _UNSPSC_ROWS_XPATH)))
+        except TimeoutException:
+            pass
+        html = driver.page_source
+    except Exception:
+        drivers.discard(driver)
+        raise
+    drivers.release(driver)
+    return html
+
+
+# Fetch one product page and extract its fields into a row result. Plain HTTP
+# comes first; given a driver pool, pages whose HTML has no UNSPSC rows (or
+# that turn plain clients away with a 403) are loaded again in Chrome
+def _fetch_row(session, url, drivers=None):
+    row_result = _new_result()
+    try:
+        with session.get(url, timeout=(CONNECT_TIMEOUT, TIMEOUT), stream=True) as resp:
+            status_code = resp.status_code
+            html, skip_reason = _read_html(resp) if status_code == 200 else (None, "")
+        part = feature = code = None
+        if html is not None:
+            # Parsed right here on the worker thread: most pages only need the
+            # regex scan, and lxml drops the GIL while building a tree, so a
+            # process pool would mostly add the cost of pickling each page
+            part, feature, code = _extract_fields(html)
+        needs_js = drivers is not None and (status_code == 403 or (html is not None and code is None))
+        if needs_js:
+            # A Chrome failure (no driver, page-load timeout, crash) leaves the
+            # plain-HTTP result as it was. The rendered page only adds what
+            # it found: its part and UNSPSC replace the HTTP ones when present
+            try:
+                rendered = _render_page(drivers, url)
+            except Exception:
+                rendered = None
+            if rendered is not None:
+                status_code, html = 200, rendered
+                rendered_part, rendered_feature, rendered_code = _extract_fields(rendered)
+                part = rendered_part or part
+                if rendered_code:
+                    feature, code = rendered_feature, rendered_code
+        if status_code != 200:
+            row_result["Status"] = f"HTTP {status_code}"
+            row_result["Error"] = f"Status {status_code}"
+        elif html is None:
+            row_result["Status"] = "Skipped"
+            row_result["Error"] = skip_reason
+        else:
+            if part:
+                row_result["Part"] = part
+            if code:
+                row_result["UNSPSC Feature (Latest)"] = feature
+                row_result["UNSPSC Code"] = code
+    except Exception as e:
+        row_result["Status"] = "Error"
+        row_result["Error"] = str(e)[:100]
+    return row_result
+
+
+# Open a pooled connection (DNS lookup, TCP and TLS handshakes) to the host
+# most of the uncached pages are on, so later requests there skip the cold
+# start. Runs as the first task on the fetch pool, never on the script
+# thread, and does nothing when every page will come from the HTTP cache.
+# The HEAD neither reads nor writes the cache, and a failure is left for the
+# real fetches to report
+def _warm_up(session, urls):
+    if not session.settings.disabled:
+        urls = [url for url in urls if not session.cache.contains(url=url)]
+    if not urls:
+        return
+    scheme, host = Counter(urlsplit(url)[:2] for url in urls).most_common(1)[0][0]
+    try:
+        session.head(f"{scheme}://{host}/", headers={"Cache-Control": "no-store"}, timeout=CONNECT_TIMEOUT)
+    except requests.RequestException:
+        pass
+
+
+# (row index, result) for each of `rows` (all with a valid URL), in completion
+# order. Already-fetched rows come first; every other canonical URL is fetched once
+# on a worker thread and its result is yielded for all rows sharing it.
+# Dedup happens here, before dispatch: workers (_fetch_row) keep no shared
+# state, and `fetched` is only touched on the calling (main) thread
+def _iter_row_results(session, rows, urls, keys, fetched, workers, drivers=None):
+    waiting = {}  # canonical URL -> row indexes
+    for idx in rows:
+        if keys[idx] in fetched:
+            yield idx, dict(fetched[keys[idx]])
+        else:
+            waiting.setdefault(keys[idx], []).append(idx)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="swgl")
+    try:
+        if waiting:
+            executor.submit(_warm_up, session, [urls[idxs[0]] for idxs in waiting.values()])
+        futures = {executor.submit(_fetch_row, session, urls[idxs[0]], drivers): key for key, idxs in waiting.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            fetched[key] = future.result()
+            for idx in waiting[key]:
+                yield idx, dict(fetched[key])
+    finally:
+        # When the caller stops early (a Streamlit rerun or stop raises inside
+        # its loop), queued fetches are cancelled instead of waited on
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Checkpoint download built from a pickled snapshot of the results. xlsxwriter
+# in constant_memory mode writes each row out as it goes
+def _checkpoint_bytes(snapshot_path, ext):
+    cp_df = pd.read_pickle(snapshot_path)
+    buf = BytesIO()
+    if ext == "csv":
+        cp_df.to_csv(buf, index=False)
+    else:
+        with pd.ExcelWriter(buf, engine="xlsxwriter",
+                            engine_kwargs={"options": {"constant_memory": True}}) as writer:
+            cp_df.to_excel(writer, index=False)
+    return buf.getvalue()
+
+
+# Previously fetched results keyed by canonical URL ({} if none). The state
+# file is JSON Lines, one {"key", "result", "ts"} record per line; a line cut
+# short by a crash (or otherwise malformed) is skipped, and results older than STATE_EXPIRE are
+# dropped so those pages are fetched (or revalidated) again. Result values
+# are interned: decoding gives every record its own "Not Found", "Success"
+# and feature strings, which a large state file would otherwise hold
+# thousands of copies of. When some lines were dropped or superseded by a
+# later record for the same key, the file is rewritten without them so it
+# does not grow run after run
+def _load_state():
+    state = {}
+    stamps = {}  # key -> ts of its latest record
+    lines = 0
+    cutoff = time.time() - STATE_EXPIRE
+    try:
+        with STATE_FILE.open("rb") as f:
+            for line in f:
+                lines += 1
+                # Lines that are not JSON, or not a record of the expected
+                # shape, are skipped rather than failing the run
+                try:
+                    record = orjson.loads(line)
+                    if record.get("ts", 0) >= cutoff:
+                        state[record["key"]] = {col: sys.intern(val) for col, val in record["result"].items()}
+                        stamps[record["key"]] = record["ts"]
+                except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+                    continue
+    except OSError:
+        pass
+    if lines > len(state):
+        _compact_state(state, stamps)
+    return state
+
+
+# Rewrite the state file with one record per key. The new file is written
+# next to it and swapped in, so a crash leaves either the old or the new one
+def _compact_state(state, stamps):
+    tmp_file = STATE_FILE.with_name(STATE_FILE.name + ".tmp")
+    try:
+        with tmp_file.open("wb") as f:
+            f.writelines(orjson.dumps({"key": k, "result": v, "ts": stamps[k]}) + b"\n" for k, v in state.items())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, STATE_FILE)
+    except OSError:
+        tmp_file.unlink(missing_ok=True)
+
+
+# Append the results for `keys` to the open state file. Only successful
+# results are passed in, so failed URLs are retried on the next run
+def _append_state(state_file, fetched, keys):
+    ts = time.time()
+    state_file.writelines(orjson.dumps({"key": k, "result": fetched[k], "ts": ts}) + b"\n" for k in keys)
+    state_file.flush()
+
+
+# Uploaded sheet as the working frame, with the URL column detected and
+# renamed to "URL" and the result columns added, plus each row's stripped URL
+# (None for non-links), its canonical key and the link mask. Cached on the
+# file's bytes, so Streamlit reruns (any widget change) skip re-reading the
+# sheet. url_col is None when no column holds URLs
+@st.cache_data(show_spinner=False, max_entries=4)
+def _load_upload(file_bytes, file_name):
+    if file_name.lower().endswith(".csv"):
+        df = pd.read_csv(BytesIO(file_bytes), dtype=str)
+    else:
+        # calamine (Rust) parses workbooks far faster than openpyxl; with
+        # dtype=str pandas also skips per-column type inference
+        df = pd.read_excel(BytesIO(file_bytes), engine="calamine", dtype=str)
+
+    # Identify the URL column: only text columns can hold URLs; check a small
+    # sample of each first, falling back to a full scan when none looks like one
+    text_cols = df.select_dtypes(include=["object", "string"]).columns
+    url_col = next((c for c in text_cols
+                    if df[c].dropna().head(20).astype(str).str.lower().str.startswith(("http://", "https://")).any()), None)
+    if url_col is None:
+        url_col = next((c for c in text_cols if df[c].astype(str).str.contains("http", na=False, case=False, regex=False).any()), None)
+    if url_col is None:
+        return df, None, [], [], pd.Series(dtype=bool)
+
+    # Standardize column names and add missing columns
+    df = df.rename(columns={url_col: "URL"})
+    if "Company" not in df.columns:
+        df["Company"] = COMPANY_NAME
+    for col in RESULT_COLUMNS:
+        if col not in df.columns:
+            df[col] = ""
+        # Checkpoint columns may load as float (all empty) or int (codes)
+        df[col] = df[col].astype(object)
+
+    # Stripped URL per row (None for empty cells and non-links), with vectorized
+    # string ops rather than a per-cell Python loop
+    url_values = df["URL"].astype("string").str.strip()
+    is_link = url_values.str.lower().str.startswith("http").fillna(False).astype(bool)
+    urls = url_values.astype(object).where(is_link, None).tolist()
+    # Dedup by canonical key so each distinct page is fetched only once
+    keys = [_canonicalize(u) if u is not None else None for u in urls]
+    unparsable = [i for i, (u, k) in enumerate(zip(urls, keys)) if u is not None and k is None]
+    if unparsable:
+        is_link.iloc[unparsable] = False
+        for i in unparsable:
+            urls[i] = None
+    return df, url_col, urls, keys, is_link
+
 
 # Page config and custom styles for a professional look
 st.set_page_config(page_title="Swagelok UNSPSC Scraper", page_icon="🔍", layout="wide")
@@ -32,154 +662,191 @@ st.markdown('<div class="main-header"><h1>🔍 Swagelok UNSPSC Platform</h1>'
             '<p>Extract Part • UNSPSC feature & code from Swagelok product pages</p></div>', unsafe_allow_html=True)
 st.markdown('<div class="info-box"><strong>🔄 Workflow:</strong> Upload Excel → Process rows → Download results</div>', unsafe_allow_html=True)
 
+use_cache = st.sidebar.checkbox("💾 Use cached responses", value=True,
+                                help="Reuse pages and results from earlier runs instead of fetching them again")
+if st.sidebar.button("🗑️ Clear HTTP cache"):
+    _make_session().cache.clear()
+    st.session_state.pop("fetched", None)
+    STATE_FILE.unlink(missing_ok=True)
+    st.sidebar.success("Cache cleared")
+# Fetching is network-bound, so concurrency can go well past the CPU count
+workers = st.sidebar.slider("⚙️ Concurrency (parallel fetches)", 4, MAX_CONCURRENCY, MAX_WORKERS)
+# Past the site's comfort zone more concurrency only brings 429/503s and slow
+# responses; pacing requests keeps latency flat
+max_rate = st.sidebar.number_input("🚦 Max requests per second (0 = no limit)", 0, 200, MAX_REQUESTS_PER_SECOND)
+render_js = st.sidebar.checkbox(
+    "🌐 Render pages without UNSPSC in Chrome (slow)", value=False,
+    help="Pages whose HTML has no UNSPSC rows are loaded again in headless Chrome")
+
 # Mode selection: new upload vs resume
 mode = st.radio("Choose mode:", ("New upload", "Resume from checkpoint"))
 file_label = "Upload Excel file (URLs only)" if mode == "New upload" else "Upload checkpoint Excel"
-uploaded_file = st.file_uploader(file_label, type=["xlsx", "xls"])
+file_types = ["xlsx", "xls"] if mode == "New upload" else ["xlsx", "xls", "csv"]
+uploaded_file = st.file_uploader(file_label, type=file_types)
 
 if uploaded_file:
     try:
-        df = pd.read_excel(uploaded_file)
+        df, url_col, urls, keys, is_link = _load_upload(uploaded_file.getvalue(), uploaded_file.name)
     except Exception as e:
         st.error(f"❌ Failed to read file: {e}")
         st.stop()
-
-    # Identify the URL column (looking for a cell containing 'http')
-    url_col = next((c for c in df.columns if df[c].astype(str).str.contains("http", na=False, case=False).any()), None)
     if not url_col:
         st.error("❌ No URL column found. Please provide an Excel with product-page URLs.")
         st.stop()
     st.success(f"✅ URL column detected: **{url_col}**")
-
-    # Standardize column names and add missing columns
-    df = df.rename(columns={url_col: "URL"})
-    if "Company" not in df.columns:
-        df["Company"] = COMPANY_NAME
-    for col in ["Part", "UNSPSC Feature (Latest)", "UNSPSC Code", "Status", "Error"]:
-        if col not in df.columns:
-            df[col] = ""
     
-    # Determine start index (for resume mode)
-    start_idx = 0
+    # Rows to process: all of them for a new upload; rows without a Status when
+    # resuming (rows finish out of order, so this is not just a tail)
     if mode == "Resume from checkpoint":
-        last_idx = df["Status"].last_valid_index()
-        start_idx = last_idx + 1 if pd.notna(last_idx) else 0
+        status = df["Status"]
+        todo = df.index[status.isna() | (status.astype(str).str.strip() == "")].tolist()
+    else:
+        todo = df.index.tolist()
 
-    urls = df["URL"].astype(str).tolist()
     total = len(urls)
-    valid_count = sum(1 for u in urls if u and u.lower().startswith("http"))
-    
-    c1, c2, c3 = st.columns(3)
+    valid_count = int(is_link.sum())
+    exact_unique = len({u for u in urls if u is not None})
+    canonical_unique = len(set(keys) - {None})
+
+    c1, c2, c3, c4, c5 = st.columns(5)
     c1.metric("📊 Total URLs", total)
     c2.metric("🔗 Valid URLs", valid_count)
-    est_time = int(valid_count * 0.25)  # rough estimate: 0.25s per row
-    c3.metric("⏱️ Est. time (s)", est_time)
+    c3.metric("🧹 Unique (exact)", exact_unique)
+    c4.metric("🧬 Unique (canonical)", canonical_unique)
+    est_time = int(canonical_unique * 0.25)  # rough estimate: 0.25s per fetched page
+    c5.metric("⏱️ Est. time (s)", est_time)
     
     if st.button("🚀 Start Extraction", type="primary"):
-        session = requests.Session()
-        session.headers.update({"User-Agent": "Mozilla/5.0"})
+        session = _make_session(workers, use_cache, max_rate)
+        drivers = _driver_pool() if render_js else None
         progress_box = st.empty()
         error_box = st.empty()
         checkpoint_box = st.empty()
         
         start_time = time.time()
-        errors = []
+        error_count = 0
+        last_error = None  # (row number, row result) of the latest failure
+        # canonical URL -> row result, reused for duplicate rows; successful results
+        # also survive Streamlit reruns (session_state) and restarts (STATE_FILE).
+        # With caching turned off every page is fetched again; with Chrome
+        # rendering on, so is every page that had no UNSPSC code last time
+        if "fetched" not in st.session_state:
+            st.session_state["fetched"] = _load_state()
+        cached = st.session_state["fetched"]
+        fetched = {k: v for k, v in cached.items()
+                   if use_cache and v["Status"] == "Success"
+                   and not (render_js and v["UNSPSC Code"] == "Not Found")}
+        st.session_state["fetched"] = fetched
+        # New successes are appended to the state file at each checkpoint
+        # through one buffered handle, not rewritten as a whole file
+        saved = set(fetched)
+        unsaved = []
         
         progress_bar = st.progress(0)   # create ONCE before loop
-        for idx in range(start_idx, total):
-            url = urls[idx]
-            row_num = idx + 1
-            progress_bar.progress((idx+1) / total)  # update only
-            
-            # Initialize default result
-            row_result = {
-                "Part": "Not Found",
-                "UNSPSC Feature (Latest)": "Not Found",
-                "UNSPSC Code": "Not Found",
-                "Status": "Success",
-                "Error": ""
-            }
+        last_update = float("-inf")    # so the first finished row is drawn immediately
+        # Rows without a usable URL get their result in one vectorized step and
+        # never enter the fetch loop
+        in_todo = df.index.isin(todo)
+        invalid_rows = df.index[in_todo & ~is_link].tolist()
+        invalid_result = {**_new_result(), "Status": "Invalid URL", "Error": "Empty or invalid URL"}
+        df.loc[invalid_rows, RESULT_COLUMNS] = [invalid_result[col] for col in RESULT_COLUMNS]
+        if invalid_rows:
+            error_count = len(invalid_rows)
+            last_error = (invalid_rows[-1] + 1, invalid_result)
+            # Shown now, in case no row is left to fetch (the loop redraws it)
+            error_box.markdown(
+                f'<div class="error-card">⚠️ <strong>Errors:</strong> {error_count}<br>'
+                f'Latest: Row {last_error[0]}: {invalid_result["Status"]} - {invalid_result["Error"]}</div>',
+                unsafe_allow_html=True)
+        fetch_rows = df.index[in_todo & is_link].tolist()
+        pending = len(fetch_rows)
+        # Results are collected column-wise in plain lists (one slot per row) and
+        # written back to df as whole columns, instead of cell-by-cell df.at calls
+        columns = {col: df[col].tolist() for col in RESULT_COLUMNS}
+        state_file = STATE_FILE.open("ab", buffering=1 << 16)
+        results = _iter_row_results(session, fetch_rows, urls, keys, fetched, workers, drivers)
+        try:
+            for done, (idx, row_result) in enumerate(results, 1):
+                row_num = idx + 1
+                is_last = done == pending
+
+                for col in RESULT_COLUMNS:
+                    columns[col][idx] = row_result[col]
             
-            # Validate URL
-            if not url or not url.lower().startswith("http"):
-                row_result["Status"] = "Invalid URL"
-                row_result["Error"] = "Empty or invalid URL"
-            else:
-                try:
-                    resp = session.get(url, timeout=TIMEOUT)
-                    if resp.status_code != 200:
-                        row_result["Status"] = f"HTTP {resp.status_code}"
-                        row_result["Error"] = f"Status {resp.status_code}"
+                if row_result["Status"] != "Success":
+                    error_count += 1
+                    last_error = (row_num, row_result)
+                elif keys[idx] not in saved:
+                    saved.add(keys[idx])
+                    unsaved.append(keys[idx])
+
+                # Update the progress status on UI (throttled; always on the last row)
+                now = time.monotonic()
+                if now - last_update >= UI_REFRESH_INTERVAL or is_last:
+                    last_update = now
+                    progress_bar.progress(done / pending)
+                    elapsed = time.time() - start_time
+                    speed = done / elapsed if elapsed > 0 else 0
+                    remaining = int((pending - done) / (speed or 1))
+                    progress_box.markdown(
+                        f'<div class="progress-card"><strong>Done {done}/{pending}</strong> (latest: row {row_num})<br>'
+                        f'Speed: {speed:.1f} rows/s | Remaining: {remaining}s<br>'
+                        f'<strong>Part:</strong> {row_result["Part"]} | '
+                        f'<strong>Code:</strong> {row_result["UNSPSC Code"]} | '
+                        f'<strong>Status:</strong> {row_result["Status"]}</div>', unsafe_allow_html=True)
+                    if last_error:
+                        err_row, err = last_error
+                        error_box.markdown(
+                            f'<div class="error-card">⚠️ <strong>Errors:</strong> {error_count}<br>'
+                            f'Latest: Row {err_row}: {err["Status"]} - {err["Error"]}</div>',
+                            unsafe_allow_html=True)
+
+                # Checkpoint: save every N rows or at end
+                if done % CHECKPOINT_INTERVAL == 0 or is_last:
+                    for col in RESULT_COLUMNS:
+                        df[col] = columns[col]
+                    _append_state(state_file, fetched, unsaved)
+                    unsaved.clear()
+                    # Only a pickle snapshot is written per checkpoint (cheap, any
+                    # column types); the CSV/XLSX is built from it when clicked
+                    if total > CSV_CHECKPOINT_ROWS:
+                        cp_ext, cp_mime = "csv", "text/csv"
                     else:
-                        soup = BeautifulSoup(resp.text, "html.parser")
-                        html = resp.text
-                        # Extract Part Number (regex search)
-                        import re
-                        m = re.search(r'Part\s*#\s*:\s*([A-Z0-9.\-_/]+)', html, re.IGNORECASE)
-                        if m:
-                            row_result["Part"] = m.group(1).strip()
-                        # Extract all UNSPSC entries from the table
-                        unspsc_entries = []
-                        for tr in soup.find_all('tr'):
-                            cells = tr.find_all('td')
-                            if len(cells) >= 2:
-                                attr = cells[0].text.strip()
-                                val = cells[1].text.strip()
-                                if attr.upper().startswith("UNSPSC") and re.match(r'^\d{6,8}$', val):
-                                    # capture feature and code
-                                    unspsc_entries.append((attr, val))
-                        # Choose the latest UNSPSC by numeric version
-                        if unspsc_entries:
-                            # sort by version inside parentheses, e.g. (17.1001)
-                            unspsc_entries.sort(key=lambda x: tuple(map(int, re.search(r'\(([\d\.]+)\)', x[0]).group(1).split('.'))), reverse=True)
-                            row_result["UNSPSC Feature (Latest)"] = unspsc_entries[0][0]
-                            row_result["UNSPSC Code"] = unspsc_entries[0][1]
-                except Exception as e:
-                    row_result["Status"] = "Error"
-                    row_result["Error"] = str(e)[:100]
-            
-            # Write results into the DataFrame
-            df.at[idx, "Part"] = row_result["Part"]
-            df.at[idx, "UNSPSC Feature (Latest)"] = row_result["UNSPSC Feature (Latest)"]
-            df.at[idx, "UNSPSC Code"] = row_result["UNSPSC Code"]
-            df.at[idx, "Status"] = row_result["Status"]
-            df.at[idx, "Error"] = row_result["Error"]
-            
-            # Update the progress status on UI
-            elapsed = time.time() - start_time
-            speed = (idx - start_idx + 1) / elapsed if elapsed > 0 else 0
-            remaining = int((total - (idx+1)) / (speed or 1))
-            progress_box.markdown(
-                f'<div class="progress-card"><strong>Row {row_num}/{total}</strong><br>'
-                f'Speed: {speed:.1f} rows/s | Remaining: {remaining}s<br>'
-                f'<strong>Part:</strong> {row_result["Part"]} | '
-                f'<strong>Code:</strong> {row_result["UNSPSC Code"]} | '
-                f'<strong>Status:</strong> {row_result["Status"]}</div>', unsafe_allow_html=True)
-            
-            if row_result["Status"] != "Success":
-                errors.append(f"Row {row_num}: {row_result['Status']} - {row_result['Error']}")
-                error_box.markdown(
-                    f'<div class="error-card">⚠️ <strong>Errors:</strong> {len(errors)}<br>Latest: {errors[-1]}</div>',
-                    unsafe_allow_html=True)
-
-            # Checkpoint: save every N rows or at end
-            if ((row_num) % CHECKPOINT_INTERVAL) == 0 or (idx == total - 1):
-                buf = BytesIO()
-                with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-                    df.to_excel(writer, index=False)
-                checkpoint_box.download_button(
-                    label=f"💾 Checkpoint ({row_num})",
-                    data=buf.getvalue(),
-                    file_name=f"checkpoint_{row_num}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    key=f"cp_{row_num}"
-                )
-        
+                        cp_ext = "xlsx"
+                        cp_mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    with tempfile.NamedTemporaryFile(suffix=".pkl", delete=False) as tmp:
+                        cp_path = Path(tmp.name)
+                    df.to_pickle(cp_path)
+                    previous = st.session_state.get("checkpoint_path")
+                    if previous:
+                        Path(previous).unlink(missing_ok=True)
+                    st.session_state["checkpoint_path"] = str(cp_path)
+                    cp_name = f"checkpoint_{done}.{cp_ext}"
+                    checkpoint_box.download_button(
+                        label=f"💾 Checkpoint ({done})",
+                        data=partial(_checkpoint_bytes, cp_path, cp_ext),
+                        file_name=cp_name,
+                        mime=cp_mime,
+                        key=f"cp_{done}"
+                    )
+        finally:
+            # Also reached when a rerun or error cuts the run short: stop the
+            # fetches, keep the successes since the last checkpoint, and sync
+            # the state file to disk
+            results.close()
+            _append_state(state_file, fetched, unsaved)
+            unsaved.clear()
+            os.fsync(state_file.fileno())
+            state_file.close()
+            # Idle browsers are not kept around between runs
+            if drivers is not None:
+                drivers.close_all()
+
         # Summary of results
-        total_processed = total - start_idx
-        success_count = (df.loc[start_idx:, "Status"] == "Success").sum()
-        parts_found = (df.loc[start_idx:, "Part"] != "Not Found").sum()
-        unspsc_found = (df.loc[start_idx:, "UNSPSC Code"] != "Not Found").sum()
+        total_processed = len(todo)
+        success_count = (df.loc[todo, "Status"] == "Success").sum()
+        parts_found = (df.loc[todo, "Part"] != "Not Found").sum()
+        unspsc_found = (df.loc[todo, "UNSPSC Code"] != "Not Found").sum()
         run_time = int(time.time() - start_time)
         st.markdown(
             f'<div class="success-box"><h2>✅ Complete!</h2>'
@@ -187,24 +854,41 @@ if uploaded_file:
             f'<p><strong>Success:</strong> {success_count}/{total_processed} | '
             f'<strong>Parts found:</strong> {parts_found} | '
             f'<strong>UNSPSC found:</strong> {unspsc_found} | '
-            f'<strong>Errors:</strong> {len(errors)}</p></div>', unsafe_allow_html=True)
+            f'<strong>Errors:</strong> {error_count}</p></div>', unsafe_allow_html=True)
         c1, c2, c3, c4 = st.columns(4)
         c1.metric("✅ Success", success_count)
         c2.metric("✅ Parts", parts_found)
         c3.metric("✅ UNSPSC", unspsc_found)
-        c4.metric("⚠️ Errors", len(errors))
+        c4.metric("⚠️ Errors", error_count)
         
         # Offer final results for download (dropping Status/Error columns)
         final_df = df.drop(columns=["Status", "Error"])
+        # Company and the UNSPSC columns repeat a handful of values across every
+        # row; as categories each distinct string is stored once
+        for col in LOW_CARDINALITY_COLUMNS:
+            final_df[col] = final_df[col].astype("category")
+        final_name = f"swagelok_unspsc_results_{int(time.time())}"
+        # xlsxwriter in constant_memory mode flushes each row as it is written
+        # instead of building the whole sheet in memory like openpyxl
         final_buf = BytesIO()
-        with pd.ExcelWriter(final_buf, engine="openpyxl") as writer:
+        with pd.ExcelWriter(final_buf, engine="xlsxwriter",
+                            engine_kwargs={"options": {"constant_memory": True}}) as writer:
             final_df.to_excel(writer, index=False, sheet_name="Results")
         st.download_button(
             "📥 Download Final Results", final_buf.getvalue(),
-            file_name=f"swagelok_unspsc_results_{int(time.time())}.xlsx",
+            file_name=f"{final_name}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
         )
+        # Parquet is much smaller and faster to write for large result sets
+        parquet_buf = BytesIO()
+        final_df.to_parquet(parquet_buf, engine="pyarrow", compression="zstd", index=False)
+        st.download_button(
+            "📦 Download as Parquet", parquet_buf.getvalue(),
+            file_name=f"{final_name}.parquet",
+            mime="application/vnd.apache.parquet",
+            use_container_width=True
+        )
         
     # Show a quick preview of the dataframe
     st.markdown("### 📋 Sample of Results")